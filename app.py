@@ -2,12 +2,13 @@
 Application d'analyse GTFS - Interface principale
 """
 
+import hashlib
 import os
 import tempfile
 import pandas as pd
 import streamlit as st
 
-from src.utils import charger_gtfs, obtenir_service_ids_pour_date
+from src.utils import DOSSIER_CACHE, charger_gtfs, obtenir_service_ids_pour_date
 from views.home import home_page
 from views.arrets import arrets_page
 from views.troncons import troncons_page
@@ -62,6 +63,8 @@ date_selected = st.sidebar.date_input("Sélectionner une date")
 # Variables globales pour stocker les résultats
 if "feed" not in st.session_state:
     st.session_state.feed = None
+if "gtfs_hash" not in st.session_state:
+    st.session_state.gtfs_hash = None
 if "active_service_ids" not in st.session_state:
     st.session_state.active_service_ids = None
 if "date_str" not in st.session_state:
@@ -90,41 +93,69 @@ def check_date_change():
         st.session_state.last_date_str = current_date_str
 
 
+@st.cache_resource(show_spinner=False, max_entries=3, ttl=3600)
+def charger_gtfs_en_cache(gtfs_hash, _contenu_zip):
+    """
+    Charge le GTFS uploadé une seule fois par fichier.
+    La clé de cache est l'empreinte du fichier, le contenu (préfixé par _)
+    n'est pas haché par Streamlit. Au plus 3 feeds restent en mémoire,
+    chacun pendant une heure au maximum.
+    """
+    # Sauvegarder temporairement le fichier
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_file:
+        tmp_file.write(_contenu_zip)
+        zip_path = tmp_file.name
+
+    try:
+        return charger_gtfs(zip_path, dossier_cache=DOSSIER_CACHE)
+    finally:
+        # Nettoyer le fichier temporaire
+        os.unlink(zip_path)
+
+
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def obtenir_service_ids_en_cache(gtfs_hash, date_str, _feed):
+    """
+    Services actifs pour une date, mis en cache par (fichier GTFS, date).
+    """
+    return obtenir_service_ids_pour_date(_feed, date_str)
+
+
 # Fonction pour charger les données
 def charger_donnees_gtfs():
     if uploaded_file is not None and date_selected is not None:
         date_str = date_selected.strftime("%Y%m%d")
-
-        # Sauvegarder temporairement le fichier
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            zip_path = tmp_file.name
+        contenu_zip = uploaded_file.getvalue()
+        gtfs_hash = hashlib.md5(contenu_zip).hexdigest()
 
         try:
-            # Charger le GTFS
+            # Charger le GTFS (instantané si ce fichier a déjà été chargé)
             with st.spinner("Chargement du fichier GTFS..."):
-                feed = charger_gtfs(zip_path)
+                feed = charger_gtfs_en_cache(gtfs_hash, contenu_zip)
 
             # Obtenir les services actifs
-            active_service_ids = obtenir_service_ids_pour_date(feed, date_str)
+            active_service_ids = obtenir_service_ids_en_cache(gtfs_hash, date_str, feed)
+
+            # Réinitialiser les indicateurs seulement si le fichier ou la date a changé
+            if (
+                st.session_state.gtfs_hash != gtfs_hash
+                or st.session_state.date_str != date_str
+            ):
+                st.session_state.indicateurs_arrets = None
+                st.session_state.indicateurs_bus = None
+                st.session_state.indicateurs_tram = None
+                st.session_state.modes_disponibles = None
 
             # Stocker dans session_state
             st.session_state.feed = feed
+            st.session_state.gtfs_hash = gtfs_hash
             st.session_state.active_service_ids = active_service_ids
             st.session_state.date_str = date_str
-            st.session_state.indicateurs_arrets = None  # Réinitialiser les indicateurs
-            st.session_state.indicateurs_bus = None
-            st.session_state.indicateurs_tram = None
-            st.session_state.modes_disponibles = None
-
-            # Nettoyer le fichier temporaire
-            os.unlink(zip_path)
 
             return True
 
         except Exception as e:
             st.error(f"Erreur lors du chargement : {e}")
-            os.unlink(zip_path)
             return False
     return False
 
@@ -3,8 +3,11 @@ POC - Analyse GTFS : Indicateurs par arrêt pour un jour donné
 Calcule pour chaque arrêt : nombre de passages, premier et dernier départ
 """
 
+import numpy as np
 import pandas as pd
 
+from src.utils import secondes_en_temps, temps_en_secondes
+
 
 def calculer_indicateurs_arrets(feed, active_service_ids: list[str], date_str: str):
     """
@@ -26,39 +29,74 @@ def calculer_indicateurs_arrets(feed, active_service_ids: list[str], date_str: s
         return None
 
     # Filtrer les trips actifs ce jour-là
-    trips_actifs = feed.trips[feed.trips["service_id"].isin(active_service_ids)]
+    trips_actifs = feed.trips.loc[
+        feed.trips["service_id"].isin(active_service_ids), ["trip_id", "route_id"]
+    ]
     print(f"✓ {len(trips_actifs)} trips actifs")
 
-    # Joindre avec stop_times
-    stop_times_actifs = feed.stop_times.merge(
-        trips_actifs[["trip_id", "service_id"]], on="trip_id"
+    # Joindre avec stop_times, restreint aux seules colonnes utiles
+    stop_times_actifs = feed.stop_times[["trip_id", "stop_id", "departure_time"]].merge(
+        trips_actifs[["trip_id", "route_id"]], on="trip_id"
     )
 
-    # Calculer les indicateurs par arrêt
-    indicateurs = (
-        stop_times_actifs.groupby("stop_id")
-        .agg(
-            nombre_passages=("trip_id", "count"),
-            premier_depart=("departure_time", "min"),
-            dernier_depart=("departure_time", "max"),
-        )
-        .reset_index()
+    # Calculer les indicateurs par arrêt en NumPy : arrêts en codes entiers,
+    # horaires en secondes, puis tri par (arrêt, horaire) ; premier et dernier
+    # départ sont alors les bornes du bloc de chaque arrêt
+    codes, stop_ids = pd.factorize(stop_times_actifs["stop_id"])
+    nb_arrets = len(stop_ids)
+    secondes = temps_en_secondes(stop_times_actifs["departure_time"]).to_numpy()
+    nombre_passages = np.bincount(codes, minlength=nb_arrets)
+
+    # Nombre de lignes distinctes par arrêt, sur les couples (arrêt, ligne)
+    codes_lignes, lignes = pd.factorize(stop_times_actifs["route_id"])
+    couples = np.unique(codes.astype("int64") * len(lignes) + codes_lignes)
+    nb_lignes = np.bincount(couples // max(len(lignes), 1), minlength=nb_arrets)
+
+    horaires_connus = ~np.isnan(secondes)
+    codes_tries, secondes_triees = codes[horaires_connus], secondes[horaires_connus]
+    ordre = np.lexsort((secondes_triees, codes_tries))
+    codes_tries, secondes_triees = codes_tries[ordre], secondes_triees[ordre]
+    # Bornes des blocs : changement d'arrêt avec le précédent / le suivant
+    # (tableaux vides si aucun départ n'a d'horaire connu)
+    debuts = np.flatnonzero(np.diff(codes_tries, prepend=-1))
+    fins = np.flatnonzero(np.diff(codes_tries, append=-1))
+
+    premier_depart = np.full(nb_arrets, np.nan)
+    dernier_depart = np.full(nb_arrets, np.nan)
+    premier_depart[codes_tries[debuts]] = secondes_triees[debuts]
+    dernier_depart[codes_tries[fins]] = secondes_triees[fins]
+
+    # Temps d'attente (en minutes) entre départs successifs d'un même arrêt,
+    # entre 07:00 et 19:00 comme le compute_stop_stats de gtfs_kit
+    en_journee = (secondes_triees >= 7 * 3600) & (secondes_triees <= 19 * 3600)
+    codes_journee = codes_tries[en_journee]
+    meme_arret = codes_journee[1:] == codes_journee[:-1]
+    attentes = np.diff(secondes_triees[en_journee])[meme_arret] / 60
+    codes_attentes = codes_journee[1:][meme_arret]
+
+    nb_attentes = np.bincount(codes_attentes, minlength=nb_arrets)
+    temps_attente_moyen = np.divide(
+        np.bincount(codes_attentes, weights=attentes, minlength=nb_arrets),
+        nb_attentes,
+        out=np.full(nb_arrets, np.nan),
+        where=nb_attentes > 0,
     )
-
-    # Utilisation de gtfs_kit pour calculer les stats de headway
-    indic_gk = feed.compute_stop_stats([date_str])
-    indicateurs = indicateurs.merge(
-        indic_gk[["stop_id", "mean_headway", "max_headway", "num_routes"]],
-        on="stop_id",
-        how="left",
-    )
-    indicateurs.rename(
-        columns={
-            "num_routes": "nb_lignes",
-            "mean_headway": "temps_attente_moyen",
-            "max_headway": "temps_attente_max",
-        },
-        inplace=True,
+    temps_attente_max = np.full(nb_arrets, np.nan)
+    np.fmax.at(temps_attente_max, codes_attentes, attentes)
+
+    indicateurs = pd.DataFrame(
+        {
+            "stop_id": stop_ids,
+            "nb_lignes": nb_lignes,
+            "nombre_passages": nombre_passages,
+            "premier_depart": secondes_en_temps(pd.Series(premier_depart)),
+            "dernier_depart": secondes_en_temps(pd.Series(dernier_depart)),
+            "amplitude_horaire": secondes_en_temps(
+                pd.Series(dernier_depart - premier_depart)
+            ),
+            "temps_attente_moyen": temps_attente_moyen,
+            "temps_attente_max": temps_attente_max,
+        }
     )
 
     # Joindre avec les informations des arrêts
@@ -68,15 +106,6 @@ def calculer_indicateurs_arrets(feed, active_service_ids: list[str], date_str: s
         how="left",
     )
 
-    # Calculer l'amplitude horaire
-    indicateurs["amplitude_horaire"] = pd.to_timedelta(
-        indicateurs["dernier_depart"]
-    ) - pd.to_timedelta(indicateurs["premier_depart"])
-    # nettoyer pour retirer le 0 days
-    indicateurs["amplitude_horaire"] = indicateurs["amplitude_horaire"].apply(
-        lambda x: str(x).replace("0 days ", " ").strip()
-    )
-
     # Réorganiser les colonnes
     indicateurs = indicateurs[
         [
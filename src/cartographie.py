@@ -1,6 +1,7 @@
 import folium
 from folium import plugins
 import numpy as np
+import geopandas as gpd
 import branca.colormap as cm
 
 
@@ -17,20 +18,12 @@ def create_carte_arrets(df):
 
     # Définir les seuils pour les couleurs
     passages_values = df["nombre_passages"].values
-    bins = np.percentile(passages_values, [0, 25, 50, 75, 100])
-    bins = [0] + list(bins[1:])  # Assurer que le minimum est 0
-
-    def get_color(passages):
-        if passages == 0:
-            return "gray"
-        elif passages <= bins[1]:
-            return "green"
-        elif passages <= bins[2]:
-            return "yellow"
-        elif passages <= bins[3]:
-            return "orange"
-        else:
-            return "red"
+    bins = np.quantile(passages_values, [0, 0.25, 0.5, 0.75])
+    bins[0] = 0  # Assurer que le minimum est 0
+
+    # Couleur par arrêt : indice de classe lu dans la palette (0 passage en gris)
+    palette = np.array(["gray", "green", "yellow", "orange", "red"])
+    couleurs = palette[np.digitize(passages_values, bins, right=True)]
 
     m = folium.Map(
         location=[df["stop_lat"].mean(), df["stop_lon"].mean()],
@@ -39,26 +32,129 @@ def create_carte_arrets(df):
         height="500px",
     )
 
-    for _, row in df.iterrows():
-        stop_id = row["stop_id"]
-        lat = row["stop_lat"]
-        lon = row["stop_lon"]
-        passages = row["nombre_passages"]
-
-        color = get_color(passages)
+    # Une seule couche GeoJSON pour l'ensemble des arrêts
+    gdf = gpd.GeoDataFrame(
+        {
+            "stop_id": df["stop_id"].to_numpy(),
+            "nombre_passages": passages_values,
+            "color": couleurs,
+        },
+        geometry=gpd.points_from_xy(df["stop_lon"], df["stop_lat"]),
+        crs="EPSG:4326",
+    )
 
-        folium.CircleMarker(
-            location=[lat, lon],
-            radius=2,
-            popup=f"Arrêt ID: {stop_id}\nPassages: {passages}",
-            color=color,
-            fill=True,
-            fill_color=color,
-        ).add_to(m)
+    folium.GeoJson(
+        gdf,
+        marker=folium.CircleMarker(radius=2, fill=True),
+        style_function=lambda feature: {
+            "color": feature["properties"]["color"],
+            "fillColor": feature["properties"]["color"],
+        },
+        popup=folium.GeoJsonPopup(
+            fields=["stop_id", "nombre_passages"],
+            aliases=["Arrêt ID", "Passages"],
+        ),
+    ).add_to(m)
 
     return m
 
 
+def ajouter_couche_troncons(m, gdf, colonne_frequence, nom_couche, couleurs, caption):
+    """
+    Ajoute à la carte une couche GeoJSON des tronçons actifs d'un mode.
+    Couleur et épaisseur dépendent de la fréquence, calculées en vectoriel.
+
+    Parameters:
+    -----------
+    m : folium.Map
+        Carte à enrichir
+    gdf : GeoDataFrame | None
+        GeoDataFrame des tronçons avec indicateurs (None si aucun passage)
+    colonne_frequence : str
+        Nom de la colonne contenant la fréquence
+    nom_couche : str
+        Nom de la couche dans le contrôle des couches
+    couleurs : list[str]
+        Couleurs de la palette, de la plus faible à la plus forte fréquence
+    caption : str
+        Légende de la palette de couleurs
+    """
+    if gdf is None or len(gdf) == 0 or colonne_frequence not in gdf.columns:
+        return
+
+    # Filtrer les tronçons avec passages
+    gdf_actif = gdf[gdf[colonne_frequence] > 0]
+    if len(gdf_actif) == 0:
+        return
+
+    freq = gdf_actif[colonne_frequence].to_numpy()
+    vmin, vmax = freq.min(), freq.max()
+
+    colormap = cm.LinearColormap(colors=couleurs, vmin=vmin, vmax=vmax, caption=caption)
+
+    # Ne garder que les propriétés utiles pour alléger le GeoJSON
+    gdf_carte = gpd.GeoDataFrame(
+        {
+            "troncon_unique_id": gdf_actif["troncon_unique_id"],
+            "stop_depart_name": gdf_actif["stop_depart_name"],
+            "stop_arrivee_name": gdf_actif["stop_arrivee_name"],
+            "passages": gdf_actif[colonne_frequence].astype(int),
+            "vitesse_moyenne_kmh": gdf_actif["vitesse_moyenne_kmh"].round(1),
+            "distance_km": gdf_actif["distance_km"].round(2),
+        },
+        geometry=gdf_actif.geometry,
+        crs="EPSG:4326",
+    )
+    gdf_carte["color"] = [colormap(v) for v in freq]
+    # Épaisseur proportionnelle à la fréquence
+    if vmax > vmin:
+        gdf_carte["weight"] = 2 + (freq - vmin) / (vmax - vmin) * 6
+    else:
+        gdf_carte["weight"] = 2.0
+    gdf_carte["tooltip"] = (
+        gdf_carte["stop_depart_name"]
+        + " → "
+        + gdf_carte["stop_arrivee_name"]
+        + ": "
+        + gdf_carte["passages"].astype(str)
+        + " passages"
+    )
+
+    feature_group = folium.FeatureGroup(name=nom_couche, show=True)
+
+    folium.GeoJson(
+        gdf_carte,
+        style_function=lambda feature: {
+            "color": feature["properties"]["color"],
+            "weight": feature["properties"]["weight"],
+            "opacity": 0.8,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        popup=folium.GeoJsonPopup(
+            fields=[
+                "troncon_unique_id",
+                "stop_depart_name",
+                "stop_arrivee_name",
+                "passages",
+                "vitesse_moyenne_kmh",
+                "distance_km",
+            ],
+            aliases=[
+                "ID",
+                "De",
+                "À",
+                "Passages",
+                "Vitesse moy. (km/h)",
+                "Distance (km)",
+            ],
+            max_width=300,
+        ),
+    ).add_to(feature_group)
+
+    feature_group.add_to(m)
+    colormap.add_to(m)
+
+
 def creer_carte_troncons(gdf_bus, gdf_tram, colonne_frequence="nombre_passages"):
     """
     Crée une carte Folium interactive avec les tronçons bus et tram.
@@ -66,10 +162,10 @@ def creer_carte_troncons(gdf_bus, gdf_tram, colonne_frequence="nombre_passages")
 
     Parameters:
     -----------
-    gdf_bus : GeoDataFrame
-        GeoDataFrame des tronçons bus avec indicateurs
-    gdf_tram : GeoDataFrame
-        GeoDataFrame des tronçons tram avec indicateurs
+    gdf_bus : GeoDataFrame | None
+        GeoDataFrame des tronçons bus avec indicateurs (None si aucun passage)
+    gdf_tram : GeoDataFrame | None
+        GeoDataFrame des tronçons tram avec indicateurs (None si aucun passage)
     colonne_frequence : str
         Nom de la colonne contenant la fréquence (défaut: 'nombre_passages')
 
@@ -82,7 +178,7 @@ def creer_carte_troncons(gdf_bus, gdf_tram, colonne_frequence="nombre_passages")
     # Déterminer le centre de la carte (moyenne des coordonnées)
     all_coords = []
     for gdf in [gdf_bus, gdf_tram]:
-        if len(gdf) > 0:
+        if gdf is not None and len(gdf) > 0:
             all_coords.extend(gdf["lat_depart_parent"].dropna().tolist())
             all_coords.extend(gdf["lat_arrivee_parent"].dropna().tolist())
 
@@ -92,7 +188,7 @@ def creer_carte_troncons(gdf_bus, gdf_tram, colonne_frequence="nombre_passages")
         center_lat = np.mean(all_coords)
         all_lons = []
         for gdf in [gdf_bus, gdf_tram]:
-            if len(gdf) > 0:
+            if gdf is not None and len(gdf) > 0:
                 all_lons.extend(gdf["lon_depart_parent"].dropna().tolist())
                 all_lons.extend(gdf["lon_arrivee_parent"].dropna().tolist())
         center_lon = np.mean(all_lons)
@@ -107,120 +203,24 @@ def creer_carte_troncons(gdf_bus, gdf_tram, colonne_frequence="nombre_passages")
     folium.TileLayer("cartodbdark_matter", name="Carto Dark").add_to(m)
 
     # ===== TRONÇONS BUS =====
-    if len(gdf_bus) > 0 and colonne_frequence in gdf_bus.columns:
-        # Filtrer les tronçons avec passages
-        gdf_bus_actif = gdf_bus[gdf_bus[colonne_frequence] > 0].copy()
-
-        if len(gdf_bus_actif) > 0:
-            # Créer la palette de couleurs pour les bus
-            vmin_bus = gdf_bus_actif[colonne_frequence].min()
-            vmax_bus = gdf_bus_actif[colonne_frequence].max()
-
-            colormap_bus = cm.LinearColormap(
-                colors=["#fee5d9", "#fcae91", "#fb6a4a", "#de2d26", "#a50f15"],
-                vmin=vmin_bus,
-                vmax=vmax_bus,
-                caption=f"Nombre de passages Bus",
-            )
-
-            # Créer un groupe de features pour les bus
-            feature_group_bus = folium.FeatureGroup(name="🚌 Bus", show=True)
-
-            # Ajouter chaque tronçon bus
-            for idx, row in gdf_bus_actif.iterrows():
-                freq = row[colonne_frequence]
-                color = colormap_bus(freq)
-
-                # Extraire les coordonnées de la géométrie
-                coords = [(coord[1], coord[0]) for coord in row["geometry"].coords]
-
-                # Créer le popup avec les informations
-                popup_html = f"""
-                <div style="font-family: Arial; font-size: 12px; width: 250px;">
-                    <b style="color: #d63447;">🚌 TRONÇON BUS</b><br>
-                    <hr style="margin: 5px 0;">
-                    <b>ID:</b> {row.get('troncon_unique_id', 'N/A')}<br>
-                    <b>De:</b> {row.get('stop_depart_name', 'N/A')}<br>
-                    <b>À:</b> {row.get('stop_arrivee_name', 'N/A')}<br>
-                    <hr style="margin: 5px 0;">
-                    <b>Passages:</b> {int(freq)}<br>
-                    <b>Vitesse moy.:</b> {row.get('vitesse_moyenne_kmh', 0):.1f} km/h<br>
-                    <b>Distance:</b> {row.get('distance_km', 0):.2f} km
-                </div>
-                """
-
-                # Épaisseur proportionnelle à la fréquence
-                weight = 2 + (freq - vmin_bus) / (vmax_bus - vmin_bus) * 6
-
-                folium.PolyLine(
-                    coords,
-                    color=color,
-                    weight=weight,
-                    opacity=0.8,
-                    popup=folium.Popup(popup_html, max_width=300),
-                    tooltip=f"{row.get('stop_depart_name', '')} → {row.get('stop_arrivee_name', '')}: {int(freq)} passages",
-                ).add_to(feature_group_bus)
-
-            feature_group_bus.add_to(m)
-            colormap_bus.add_to(m)
+    ajouter_couche_troncons(
+        m,
+        gdf_bus,
+        colonne_frequence,
+        nom_couche="🚌 Bus",
+        couleurs=["#fee5d9", "#fcae91", "#fb6a4a", "#de2d26", "#a50f15"],
+        caption="Nombre de passages Bus",
+    )
 
     # ===== TRONÇONS TRAM =====
-    if len(gdf_tram) > 0 and colonne_frequence in gdf_tram.columns:
-        # Filtrer les tronçons avec passages
-        gdf_tram_actif = gdf_tram[gdf_tram[colonne_frequence] > 0].copy()
-
-        if len(gdf_tram_actif) > 0:
-            # Créer la palette de couleurs pour les trams
-            vmin_tram = gdf_tram_actif[colonne_frequence].min()
-            vmax_tram = gdf_tram_actif[colonne_frequence].max()
-
-            colormap_tram = cm.LinearColormap(
-                colors=["#edf8e9", "#bae4b3", "#74c476", "#31a354", "#006d2c"],
-                vmin=vmin_tram,
-                vmax=vmax_tram,
-                caption=f"Nombre de passages Tram",
-            )
-
-            # Créer un groupe de features pour les trams
-            feature_group_tram = folium.FeatureGroup(name="🚊 Tram", show=True)
-
-            # Ajouter chaque tronçon tram
-            for idx, row in gdf_tram_actif.iterrows():
-                freq = row[colonne_frequence]
-                color = colormap_tram(freq)
-
-                # Extraire les coordonnées de la géométrie
-                coords = [(coord[1], coord[0]) for coord in row["geometry"].coords]
-
-                # Créer le popup avec les informations
-                popup_html = f"""
-                <div style="font-family: Arial; font-size: 12px; width: 250px;">
-                    <b style="color: #28a745;">🚊 TRONÇON TRAM</b><br>
-                    <hr style="margin: 5px 0;">
-                    <b>ID:</b> {row.get('troncon_unique_id', 'N/A')}<br>
-                    <b>De:</b> {row.get('stop_depart_name', 'N/A')}<br>
-                    <b>À:</b> {row.get('stop_arrivee_name', 'N/A')}<br>
-                    <hr style="margin: 5px 0;">
-                    <b>Passages:</b> {int(freq)}<br>
-                    <b>Vitesse moy.:</b> {row.get('vitesse_moyenne_kmh', 0):.1f} km/h<br>
-                    <b>Distance:</b> {row.get('distance_km', 0):.2f} km
-                </div>
-                """
-
-                # Épaisseur proportionnelle à la fréquence
-                weight = 2 + (freq - vmin_tram) / (vmax_tram - vmin_tram) * 6
-
-                folium.PolyLine(
-                    coords,
-                    color=color,
-                    weight=weight,
-                    opacity=0.8,
-                    popup=folium.Popup(popup_html, max_width=300),
-                    tooltip=f"{row.get('stop_depart_name', '')} → {row.get('stop_arrivee_name', '')}: {int(freq)} passages",
-                ).add_to(feature_group_tram)
-
-            feature_group_tram.add_to(m)
-            colormap_tram.add_to(m)
+    ajouter_couche_troncons(
+        m,
+        gdf_tram,
+        colonne_frequence,
+        nom_couche="🚊 Tram",
+        couleurs=["#edf8e9", "#bae4b3", "#74c476", "#31a354", "#006d2c"],
+        caption="Nombre de passages Tram",
+    )
 
     # Ajouter le contrôle des couches (cases à cocher)
     folium.LayerControl(collapsed=False).add_to(m)
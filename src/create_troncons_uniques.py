@@ -3,9 +3,10 @@ Création optimisée des tronçons uniques GTFS
 Tronçons par mode de transport, deux sens confondus, à la station parent
 """
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString
+import shapely
 
 
 def creer_troncons_uniques(feed, route_type):
@@ -28,19 +29,19 @@ def creer_troncons_uniques(feed, route_type):
     print(f"\nCréation des tronçons uniques pour route_type={route_type}...")
 
     # 1. Préparer le mapping vers les parent_stations
+    # parent_station manquant ou vide -> l'arrêt est son propre parent
     stops = feed.stops.copy()
-    stops["parent_station"] = stops["parent_station"].fillna(stops["stop_id"])
-    stops.loc[stops["parent_station"] == "", "parent_station"] = stops["stop_id"]
+    ps = stops["parent_station"].to_numpy(dtype=object, na_value="")
+    stops["parent_station"] = np.where(ps == "", stops["stop_id"].to_numpy(), ps)
 
-    # Mapping stop_id -> parent_station
-    stop_to_parent = stops.set_index("stop_id")["parent_station"].to_dict()
+    # Mapping stop_id -> parent_station (Series indexée, lookup par table de hachage)
+    stop_to_parent = stops.set_index("stop_id")["parent_station"]
 
     # Infos des parents (coords, noms)
-    parent_info = (
-        stops[stops["stop_id"] == stops["parent_station"]]
-        .set_index("stop_id")[["stop_name", "stop_lat", "stop_lon"]]
-        .to_dict("index")
-    )
+    parents = stops.loc[
+        stops["stop_id"] == stops["parent_station"],
+        ["stop_id", "stop_name", "stop_lat", "stop_lon"],
+    ]
 
     # 2. Filtrer les trips du bon type de route
     routes_filtrees = feed.routes[feed.routes["route_type"] == route_type]["route_id"]
@@ -62,56 +63,85 @@ def creer_troncons_uniques(feed, route_type):
     # 6. Créer les paires d'arrêts consécutifs
     print("  → Création des paires d'arrêts consécutifs...")
 
-    # Décalage pour obtenir l'arrêt suivant
-    stop_times["stop_parent_suivant"] = stop_times.groupby("trip_id")[
-        "stop_parent"
-    ].shift(-1)
-
-    # Supprimer les derniers arrêts de chaque trip (pas de suivant)
-    paires = stop_times.dropna(subset=["stop_parent_suivant"]).copy()
+    # Arrêt suivant = ligne suivante, tant qu'elle appartient au même trip :
+    # une comparaison des codes de trip entre lignes voisines remplace le
+    # groupby().shift(-1), et exclut d'office les derniers arrêts de chaque trip
+    trip_codes, _ = pd.factorize(stop_times["trip_id"])
+    meme_trip = trip_codes[:-1] == trip_codes[1:]
+    stop_parents = stop_times["stop_parent"].to_numpy()
+
+    paires = pd.DataFrame(
+        {
+            "stop_parent": stop_parents[:-1][meme_trip],
+            "stop_parent_suivant": stop_parents[1:][meme_trip],
+        }
+    ).dropna()
 
     # 7. Créer une clé unique pour chaque paire (tous sens confondus)
     print("  → Normalisation des paires (tous sens confondus)...")
 
-    paires["stop_pair"] = paires.apply(
-        lambda row: tuple(sorted([row["stop_parent"], row["stop_parent_suivant"]])),
-        axis=1,
+    # Codes entiers triés : l'ordre des codes est l'ordre alphabétique des
+    # arrêts, donc pair_lo <= pair_hi se calcule avec min/max sur des entiers
+    n_paires = len(paires)
+    codes, arrets_parents = pd.factorize(
+        np.concatenate(
+            [
+                paires["stop_parent"].to_numpy(),
+                paires["stop_parent_suivant"].to_numpy(),
+            ]
+        ),
+        sort=True,
     )
+    code_lo = np.minimum(codes[:n_paires], codes[n_paires:]).astype(np.int64)
+    code_hi = np.maximum(codes[:n_paires], codes[n_paires:]).astype(np.int64)
 
     # 8. Dédupliquer pour obtenir les tronçons uniques
-    troncons_uniques = paires[["stop_pair"]].drop_duplicates().reset_index(drop=True)
+    # Une clé int64 par paire ; on garde la première occurrence de chaque clé
+    # (même ordre que drop_duplicates)
+    cle = (code_lo << 32) | code_hi
+    _, premieres = np.unique(cle, return_index=True)
+    premieres.sort()
+
+    troncons_uniques = pd.DataFrame(
+        {
+            "pair_lo": arrets_parents[code_lo[premieres]],
+            "pair_hi": arrets_parents[code_hi[premieres]],
+        }
+    )
 
     print(f"  → {len(troncons_uniques)} tronçons uniques identifiés")
 
     # 9. Enrichir avec les informations des arrêts
     print("  → Enrichissement avec coordonnées et noms...")
 
-    def enrichir_troncon(stop_pair):
-        """Enrichit un tronçon avec les infos des deux arrêts"""
-        stop1, stop2 = stop_pair
-
-        # Infos du parent 1
-        info1 = parent_info.get(stop1, {})
-        # Infos du parent 2
-        info2 = parent_info.get(stop2, {})
-
-        return {
-            "stop_depart_parent_id": stop1,
-            "stop_arrivee_parent_id": stop2,
-            "stop_depart_name": info1.get("stop_name", ""),
-            "stop_arrivee_name": info2.get("stop_name", ""),
-            "lat_depart_parent": info1.get("stop_lat", None),
-            "lon_depart_parent": info1.get("stop_lon", None),
-            "lat_arrivee_parent": info2.get("stop_lat", None),
-            "lon_arrivee_parent": info2.get("stop_lon", None),
-        }
-
-    # Appliquer l'enrichissement
-    infos_enrichies = troncons_uniques["stop_pair"].apply(enrichir_troncon)
-    df_enrichi = pd.DataFrame(infos_enrichies.tolist())
+    # Jointures sur les parents : une pour le départ, une pour l'arrivée
+    troncons_uniques = troncons_uniques.merge(
+        parents.add_prefix("dep_"),
+        left_on="pair_lo",
+        right_on="dep_stop_id",
+        how="left",
+    ).merge(
+        parents.add_prefix("arr_"),
+        left_on="pair_hi",
+        right_on="arr_stop_id",
+        how="left",
+    )
 
-    # Combiner avec l'index original
-    troncons_uniques = pd.concat([troncons_uniques, df_enrichi], axis=1)
+    troncons_uniques = troncons_uniques.rename(
+        columns={
+            "pair_lo": "stop_depart_parent_id",
+            "pair_hi": "stop_arrivee_parent_id",
+            "dep_stop_name": "stop_depart_name",
+            "arr_stop_name": "stop_arrivee_name",
+            "dep_stop_lat": "lat_depart_parent",
+            "dep_stop_lon": "lon_depart_parent",
+            "arr_stop_lat": "lat_arrivee_parent",
+            "arr_stop_lon": "lon_arrivee_parent",
+        }
+    )
+    troncons_uniques[["stop_depart_name", "stop_arrivee_name"]] = troncons_uniques[
+        ["stop_depart_name", "stop_arrivee_name"]
+    ].fillna("")
 
     # 10. Générer les identifiants et géométries
     print("  → Génération des identifiants et géométries...")
@@ -124,29 +154,23 @@ def creer_troncons_uniques(feed, route_type):
         f"TU_{route_type_prefix}_{i:06d}" for i in range(len(troncons_uniques))
     ]
 
-    # Géométries LineString
-    troncons_uniques["geometry"] = troncons_uniques.apply(
-        lambda row: (
-            LineString(
-                [
-                    (row["lon_depart_parent"], row["lat_depart_parent"]),
-                    (row["lon_arrivee_parent"], row["lat_arrivee_parent"]),
-                ]
-            )
-            if all(
-                pd.notna(
-                    [
-                        row["lon_depart_parent"],
-                        row["lat_depart_parent"],
-                        row["lon_arrivee_parent"],
-                        row["lat_arrivee_parent"],
-                    ]
-                )
-            )
-            else None
-        ),
+    # Géométries LineString, construites en un seul appel Shapely
+    coords = np.stack(
+        [
+            troncons_uniques[["lon_depart_parent", "lat_depart_parent"]].to_numpy(
+                dtype=np.float64
+            ),
+            troncons_uniques[["lon_arrivee_parent", "lat_arrivee_parent"]].to_numpy(
+                dtype=np.float64
+            ),
+        ],
         axis=1,
     )
+    # Les tronçons dont un arrêt n'a pas de coordonnées n'ont pas de géométrie
+    coords_valides = ~np.isnan(coords).any(axis=(1, 2))
+    geometries = np.full(len(troncons_uniques), None, dtype=object)
+    geometries[coords_valides] = shapely.linestrings(coords[coords_valides])
+    troncons_uniques["geometry"] = geometries
 
     # 11. Créer le GeoDataFrame
     colonnes_finales = [
@@ -166,10 +190,6 @@ def creer_troncons_uniques(feed, route_type):
         troncons_uniques[colonnes_finales], geometry="geometry", crs="EPSG:4326"
     )
 
-    # Supprimer la colonne temporaire stop_pair
-    if "stop_pair" in gdf.columns:
-        gdf = gdf.drop(columns=["stop_pair"])
-
     print(f"✓ {len(gdf)} tronçons uniques créés")
 
     return gdf
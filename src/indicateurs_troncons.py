@@ -8,7 +8,10 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 
-from src.utils import charger_gtfs, obtenir_service_ids_pour_date
+from src.utils import charger_gtfs, obtenir_service_ids_pour_date, temps_en_secondes
+
+# Colonnes de la clé normalisée des paires de stops (voir creer_cle_paire)
+COLONNES_CLE_PAIRE = ["stop_pair_min", "stop_pair_max"]
 
 
 def calculer_distance_haversine(lat1, lon1, lat2, lon2):
@@ -28,45 +31,63 @@ def calculer_distance_haversine(lat1, lon1, lat2, lon2):
     return R * c
 
 
-def convertir_temps_en_secondes(temps_str):
+def creer_cle_paire(stops_a, stops_b):
     """
-    Convertit un temps GTFS (HH:MM:SS) en secondes
-    Gère les heures > 24 (ex: 25:30:00 pour 01:30 le lendemain)
+    Crée la clé normalisée de paires de stops, tous sens confondus :
+    couple (stop_min, stop_max) dans l'ordre alphabétique, calculé en
+    vectoriel. Les deux identifiants restent séparés (pas de concaténation
+    avec un séparateur, qui pourrait figurer dans un stop_id)
     """
-    if pd.isna(temps_str):
-        return None
+    stops_a = np.asarray(stops_a, dtype=object)
+    stops_b = np.asarray(stops_b, dtype=object)
+
+    inverser = stops_a > stops_b
+    premier = np.where(inverser, stops_b, stops_a)
+    second = np.where(inverser, stops_a, stops_b)
 
-    parts = str(temps_str).split(":")
-    heures = int(parts[0])
-    minutes = int(parts[1])
-    secondes = int(parts[2])
+    return premier, second
 
-    return heures * 3600 + minutes * 60 + secondes
+
+def ajouter_cle_paire(df_troncons_uniques):
+    """
+    Ajoute (si absentes) les colonnes stop_pair_min et stop_pair_max aux
+    tronçons uniques. La table des tronçons ne dépend pas de la date : la
+    clé est calculée une seule fois puis réutilisée pour chaque date analysée
+    """
+    if not set(COLONNES_CLE_PAIRE) <= set(df_troncons_uniques.columns):
+        premier, second = creer_cle_paire(
+            df_troncons_uniques["stop_depart_parent_id"],
+            df_troncons_uniques["stop_arrivee_parent_id"],
+        )
+        df_troncons_uniques["stop_pair_min"] = premier
+        df_troncons_uniques["stop_pair_max"] = second
+    return df_troncons_uniques
 
 
 def preparer_mapping_parent_stops(feed):
     """
-    Crée un mapping entre stop_id et parent_station
+    Crée un mapping entre stop_id et parent_station, sous forme de Series
+    indexée par stop_id (utilisable directement avec Series.map)
     Si parent_station n'existe pas, utilise stop_id comme parent
     """
-    stops = feed.stops.copy()
+    stops = feed.stops
 
     # Si parent_station n'existe pas ou est vide, utiliser stop_id
     if "parent_station" not in stops.columns:
-        stops["parent_station"] = stops["stop_id"]
+        parents = stops["stop_id"]
     else:
-        stops["parent_station"] = stops["parent_station"].fillna(stops["stop_id"])
+        parents = stops["parent_station"].fillna(stops["stop_id"])
         # Remplacer les chaînes vides par stop_id
-        stops.loc[stops["parent_station"] == "", "parent_station"] = stops["stop_id"]
+        parents = parents.mask(parents == "", stops["stop_id"])
 
-    return (
-        stops[["stop_id", "parent_station"]]
-        .set_index("stop_id")["parent_station"]
-        .to_dict()
+    return pd.Series(
+        parents.to_numpy(), index=stops["stop_id"].to_numpy(), name="parent_station"
     )
 
 
-def calculer_frequentation_troncons(feed, df_troncons_uniques, service_ids, route_type):
+def calculer_frequentation_troncons(
+    feed, df_troncons_uniques, service_ids, route_type, mapping_parent=None
+):
     """
     Calcule la fréquentation et la vitesse moyenne pour chaque tronçon unique
 
@@ -81,138 +102,151 @@ def calculer_frequentation_troncons(feed, df_troncons_uniques, service_ids, rout
         Liste des service_id actifs pour la date analysée
     route_type: int
         Le type de route (0=tram, 3=bus, etc.)
+    mapping_parent : Series, optional
+        Mapping stop_id -> parent_station (preparer_mapping_parent_stops),
+        calculé à partir du feed s'il n'est pas fourni
 
     Returns:
     --------
-    DataFrame avec fréquentation et vitesse moyenne par tronçon
+    GeoDataFrame avec fréquentation et vitesse moyenne par tronçon
+    (géométrie et CRS des tronçons uniques conservés)
     """
-    print("\nCalcul de la fréquentation par tronçon unique...")
+    print(
+        f"\nCalcul de la fréquentation par tronçon unique pour route_type={route_type}..."
+    )
 
     # Créer le mapping stop_id -> parent_station
-    mapping_parent = preparer_mapping_parent_stops(feed)
-
-    # Filtrer les trips actifs
-    trips_actifs = feed.trips[feed.trips["service_id"].isin(service_ids)].copy()
+    if mapping_parent is None:
+        mapping_parent = preparer_mapping_parent_stops(feed)
 
-    # Restriction au bon route_type
-    routes_filtrees = feed.routes[feed.routes["route_type"] == route_type]
-    trips_actifs = trips_actifs[
-        trips_actifs["route_id"].isin(routes_filtrees["route_id"])
+    # Filtrer les trips actifs du bon route_type, seul trip_id est utile ensuite
+    routes_filtrees = feed.routes.loc[
+        feed.routes["route_type"] == route_type, "route_id"
+    ]
+    trips_actifs = feed.trips.loc[
+        feed.trips["service_id"].isin(service_ids)
+        & feed.trips["route_id"].isin(routes_filtrees),
+        ["trip_id"],
     ]
 
     print(f"✓ {len(trips_actifs)} trips actifs")
 
-    # Enrichir stop_times avec les informations nécessaires
-    stop_times = feed.stop_times.merge(
-        trips_actifs[["trip_id", "route_id"]], on="trip_id"
+    # Enrichir stop_times, restreint aux seules colonnes utiles
+    stop_times = feed.stop_times[
+        ["trip_id", "stop_id", "stop_sequence", "arrival_time", "departure_time"]
+    ].merge(trips_actifs, on="trip_id")
+
+    # Ajouter les parent_station pour chaque stop : stop_id factorisé en codes
+    # entiers, correspondance cherchée une fois par arrêt distinct
+    codes_stop, stop_ids = pd.factorize(stop_times["stop_id"])
+    parents_distincts = mapping_parent.reindex(stop_ids).to_numpy()
+    stop_times["stop_parent_id"] = pd.api.extensions.take(
+        parents_distincts, codes_stop, allow_fill=True
     )
 
-    # Ajouter les parent_station pour chaque stop
-    stop_times["stop_parent_id"] = stop_times["stop_id"].map(mapping_parent)
-
-    # Trier par trip et séquence
-    stop_times = stop_times.sort_values(["trip_id", "stop_sequence"])
+    # Trier par trip et séquence : tri lexicographique sur les codes entiers
+    # des trip_id plutôt que sur les identifiants eux-mêmes
+    codes_trip, _ = pd.factorize(stop_times["trip_id"])
+    ordre = np.lexsort((stop_times["stop_sequence"].to_numpy(), codes_trip))
+    stop_times = stop_times.iloc[ordre].reset_index(drop=True)
+    codes_trip = codes_trip[ordre]
 
     print(f"✓ {len(stop_times)} stop_times à analyser")
 
-    # Calculer les passages par paire de stops consécutifs
-    passages_list = []
-
-    for trip_id, groupe in stop_times.groupby("trip_id"):
-        groupe = groupe.sort_values("stop_sequence").reset_index(drop=True)
-
-        for i in range(len(groupe) - 1):
-            depart = groupe.iloc[i]
-            arrivee = groupe.iloc[i + 1]
-
-            # Calculer le temps de parcours
-            temps_depart = convertir_temps_en_secondes(depart["departure_time"])
-            temps_arrivee = convertir_temps_en_secondes(arrivee["arrival_time"])
-
-            if temps_depart is not None and temps_arrivee is not None:
-                duree_secondes = temps_arrivee - temps_depart
-
-                if duree_secondes > 0:
-                    # Identifier le tronçon (tous sens confondus)
-                    parent_depart = depart["stop_parent_id"]
-                    parent_arrivee = arrivee["stop_parent_id"]
-
-                    # Créer une clé normalisée (ordre alphabétique pour regrouper les deux sens)
-                    stops_pair = tuple(sorted([parent_depart, parent_arrivee]))
-
-                    passages_list.append(
-                        {
-                            "stop_pair": stops_pair,
-                            "stop_depart_parent": parent_depart,
-                            "stop_arrivee_parent": parent_arrivee,
-                            "duree_secondes": duree_secondes,
-                            "trip_id": trip_id,
-                        }
-                    )
+    # Convertir les horaires en secondes une seule fois, sur la table triée
+    temps_depart = temps_en_secondes(stop_times["departure_time"]).to_numpy()
+    temps_arrivee = temps_en_secondes(stop_times["arrival_time"]).to_numpy()
+    parents = stop_times["stop_parent_id"].to_numpy()
+
+    # Apparier chaque stop_time (départ) avec le suivant (arrivée) : décalage
+    # d'une position sur les tableaux triés, les paires à cheval sur deux trips
+    # sont exclues
+    meme_trip = codes_trip[1:] == codes_trip[:-1]
+    duree_secondes = temps_arrivee[1:] - temps_depart[:-1]
+
+    # Horaires manquants ou durée nulle : paire écartée par un seul masque.
+    # Les lignes sans horaire ne sont pas supprimées au préalable, ce qui
+    # relierait leurs deux voisins par un tronçon inexistant
+    passages = meme_trip & ~np.isnan(duree_secondes) & (duree_secondes > 0)
+    parent_depart = parents[:-1][passages]
+    parent_arrivee = parents[1:][passages]
+
+    # Créer une clé normalisée (ordre alphabétique pour regrouper les deux sens)
+    premier, second = creer_cle_paire(parent_depart, parent_arrivee)
+    df_passages = pd.DataFrame(
+        {
+            "stop_pair_min": premier,
+            "stop_pair_max": second,
+            "stop_depart_parent": parent_depart,
+            "stop_arrivee_parent": parent_arrivee,
+            "duree_secondes": duree_secondes[passages].astype(np.int32),
+            "trip_id": stop_times["trip_id"].to_numpy()[:-1][passages],
+        }
+    )
 
-    print(f"✓ {len(passages_list)} passages détectés")
+    print(f"✓ {len(df_passages)} passages détectés")
 
-    if not passages_list:
+    if df_passages.empty:
         print("⚠ Aucun passage détecté")
         return None
 
-    df_passages = pd.DataFrame(passages_list)
-
     # Agréger par paire de stops (tous sens confondus)
     # On compte le nombre de passages et calcule la durée moyenne
-    stats_par_paire = (
-        df_passages.groupby("stop_pair")
-        .agg(
-            nombre_passages=("trip_id", "count"),
-            duree_moyenne_secondes=("duree_secondes", "mean"),
-            duree_min_secondes=("duree_secondes", "min"),
-            duree_max_secondes=("duree_secondes", "max"),
-        )
-        .reset_index()
+    # (clé en catégories : groupby sur codes entiers, sans tri final)
+    for colonne in COLONNES_CLE_PAIRE:
+        df_passages[colonne] = df_passages[colonne].astype("category")
+    stats_par_paire = df_passages.groupby(
+        COLONNES_CLE_PAIRE, sort=False, observed=True
+    ).agg(
+        nombre_passages=("duree_secondes", "size"),
+        duree_moyenne_secondes=("duree_secondes", "mean"),
+        duree_min_secondes=("duree_secondes", "min"),
+        duree_max_secondes=("duree_secondes", "max"),
     )
 
     print(f"✓ Statistiques calculées pour {len(stats_par_paire)} paires de stops")
 
     # Préparer le matching avec df_troncons_uniques
-    # Créer la même clé normalisée dans df_troncons_uniques
-    df_troncons_uniques["stop_pair"] = df_troncons_uniques.apply(
-        lambda row: tuple(
-            sorted([row["stop_depart_parent_id"], row["stop_arrivee_parent_id"]])
-        ),
-        axis=1,
+    # Même clé normalisée dans df_troncons_uniques (si pas déjà calculée)
+    ajouter_cle_paire(df_troncons_uniques)
+
+    # Joindre avec les statistiques : lecture par couple (stop_min, stop_max)
+    # dans la table indexée, les colonnes de clé ne sont pas reportées dans
+    # le résultat
+    cles = pd.MultiIndex.from_frame(
+        df_troncons_uniques[COLONNES_CLE_PAIRE].astype(object)
     )
-
-    # Joindre avec les statistiques
-    df_resultat = df_troncons_uniques.merge(stats_par_paire, on="stop_pair", how="left")
-
-    # Supprimer la colonne temporaire
-    df_resultat = df_resultat.drop(columns=["stop_pair"])
+    df_resultat = df_troncons_uniques.drop(columns=COLONNES_CLE_PAIRE)
+    if not isinstance(df_resultat, gpd.GeoDataFrame):
+        df_resultat = gpd.GeoDataFrame(
+            df_resultat, geometry="geometry", crs="EPSG:4326"
+        )
+    for colonne in stats_par_paire.columns:
+        df_resultat[colonne] = stats_par_paire[colonne].reindex(cles).to_numpy()
 
     # Calculer la distance si pas déjà présente
     if "distance_km" not in df_resultat.columns:
-        df_resultat["distance_km"] = df_resultat.apply(
-            lambda row: calculer_distance_haversine(
-                row["lat_depart_parent"],
-                row["lon_depart_parent"],
-                row["lat_arrivee_parent"],
-                row["lon_arrivee_parent"],
-            ),
-            axis=1,
+        df_resultat["distance_km"] = calculer_distance_haversine(
+            df_resultat["lat_depart_parent"].to_numpy(),
+            df_resultat["lon_depart_parent"].to_numpy(),
+            df_resultat["lat_arrivee_parent"].to_numpy(),
+            df_resultat["lon_arrivee_parent"].to_numpy(),
         )
 
-    # Calculer la vitesse moyenne en km/h
-    df_resultat["vitesse_moyenne_kmh"] = df_resultat["distance_km"] / (
-        df_resultat["duree_moyenne_secondes"] / 3600
-    )
-
-    # Calculer aussi vitesse min et max
-    df_resultat["vitesse_min_kmh"] = df_resultat["distance_km"] / (
-        df_resultat["duree_max_secondes"] / 3600
-    )
-
-    df_resultat["vitesse_max_kmh"] = df_resultat["distance_km"] / (
-        df_resultat["duree_min_secondes"] / 3600
-    )
+    # Calculer les vitesses moyenne, min et max en km/h (la vitesse min
+    # correspond à la durée max et inversement) : distance multipliée par
+    # l'inverse de la durée en heures, NaN pour les tronçons sans passage
+    distance_km = df_resultat["distance_km"].to_numpy()
+    for colonne_vitesse, colonne_duree in [
+        ("vitesse_moyenne_kmh", "duree_moyenne_secondes"),
+        ("vitesse_min_kmh", "duree_max_secondes"),
+        ("vitesse_max_kmh", "duree_min_secondes"),
+    ]:
+        duree = df_resultat[colonne_duree].to_numpy(dtype=np.float64)
+        inverse_heures = np.divide(
+            3600.0, duree, out=np.full(len(duree), np.nan), where=duree > 0
+        )
+        df_resultat[colonne_vitesse] = distance_km * inverse_heures
 
     # Remplacer les NaN (tronçons sans passage) par 0
     df_resultat["nombre_passages"] = (
@@ -251,25 +285,29 @@ def compute_indicateurs_troncons(
         Tuple de GeoDataFrame : (indicateurs_bus, indicateurs_tram)
     """
 
-    # Calculer la fréquentation
+    # Mapping stop_id -> parent_station commun aux deux modes
+    mapping_parent = preparer_mapping_parent_stops(feed)
+
+    # Calculer la fréquentation, un mode après l'autre (messages lisibles).
+    # Un calcul concurrent des deux modes n'a pas été évalué sur une machine
+    # multicœur : à mesurer avant de le réintroduire
     indicateurs_bus = calculer_frequentation_troncons(
-        feed, reference_troncons_uniques_bus, active_service_ids, route_type=3  # Bus
+        feed,
+        reference_troncons_uniques_bus,
+        active_service_ids,
+        route_type=3,  # Bus
+        mapping_parent=mapping_parent,
     )
 
     indicateurs_tram = calculer_frequentation_troncons(
-        feed, reference_troncons_uniques_tram, active_service_ids, route_type=0  # Tram
+        feed,
+        reference_troncons_uniques_tram,
+        active_service_ids,
+        route_type=0,  # Tram
+        mapping_parent=mapping_parent,
     )
 
-    # Convertir en GeoDataFrame
-    indicateurs_bus_gdf = gpd.GeoDataFrame(
-        indicateurs_bus, geometry="geometry", crs="EPSG:4326"
-    )
-
-    indicateurs_tram_gdf = gpd.GeoDataFrame(
-        indicateurs_tram, geometry="geometry", crs="EPSG:4326"
-    )
-
-    return indicateurs_bus_gdf, indicateurs_tram_gdf
+    return indicateurs_bus, indicateurs_tram
 
 
 # =============================================================================
@@ -288,26 +326,31 @@ if __name__ == "__main__":
     active_service_ids = obtenir_service_ids_pour_date(feed, date_calcul)
 
     # Charger la table des tronçons uniques
-    df_troncons_uniques_bus = creer_troncons_uniques(feed, route_type=3)
-    df_troncons_uniques_tram = creer_troncons_uniques(feed, route_type=0)
+    df_troncons_uniques_bus = ajouter_cle_paire(
+        creer_troncons_uniques(feed, route_type=3)
+    )
+    df_troncons_uniques_tram = ajouter_cle_paire(
+        creer_troncons_uniques(feed, route_type=0)
+    )
 
     # Calcul des indicateurs
     indicateurs_bus, indicateurs_tram = compute_indicateurs_troncons(
         feed, active_service_ids, df_troncons_uniques_bus, df_troncons_uniques_tram
     )
 
-    # Export en csv
-    exporter_gdf_to_csv(
-        indicateurs_bus, f"output/indicateurs_troncons_bus_{date_calcul}.csv"
-    )
-    exporter_gdf_to_csv(
-        indicateurs_tram, f"output/indicateurs_troncons_tram_{date_calcul}.csv"
-    )
+    for nom_mode, indicateurs in [("bus", indicateurs_bus), ("tram", indicateurs_tram)]:
+        # Mode sans aucun passage ce jour : rien à exporter
+        if indicateurs is None:
+            print(f"⚠ Aucun passage {nom_mode} le {date_calcul} : export ignoré")
+            continue
 
-    # Export en geojson
-    exporter_geojson(
-        indicateurs_bus, f"output/indicateurs_troncons_bus_{date_calcul}.geojson"
-    )
-    exporter_geojson(
-        indicateurs_tram, f"output/indicateurs_troncons_tram_{date_calcul}.geojson"
-    )
+        # Export en csv
+        exporter_gdf_to_csv(
+            indicateurs, f"output/indicateurs_troncons_{nom_mode}_{date_calcul}.csv"
+        )
+
+        # Export en geojson
+        exporter_geojson(
+            indicateurs,
+            f"output/indicateurs_troncons_{nom_mode}_{date_calcul}.geojson",
+        )
@@ -1,11 +1,58 @@
+import codecs
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
 import gtfs_kit as gk
 import pandas as pd
+import pyarrow as pa
+from pandas._libs.parsers import STR_NA_VALUES
+from pyarrow import csv as pacsv
 from shapely import wkt
 import geopandas as gpd
 
 
 # Configuration
 GTFS_ZIP_PATH = "data/TAM_MMM_GTFS.zip"  # À modifier
+DOSSIER_CACHE = "cache"  # Instantanés Parquet des GTFS déjà chargés
+NB_FEEDS_CACHE = 5  # Nombre maximal de GTFS conservés dans le cache
+VERSION_CACHE = 2  # À incrémenter à chaque changement du format du cache
+FICHIER_TABLES = 'tables.txt'  # Liste des tables écrites dans le cache
+
+# Tables d'un feed gtfs_kit conservées dans le cache Parquet
+TABLES_GTFS = [
+    'agency',
+    'stops',
+    'routes',
+    'trips',
+    'stop_times',
+    'calendar',
+    'calendar_dates',
+    'fare_attributes',
+    'fare_rules',
+    'shapes',
+    'frequencies',
+    'transfers',
+    'feed_info',
+    'attributions',
+]
+
+# Tables sans lesquelles un feed en cache est considéré comme absent
+TABLES_REQUISES = ['stops', 'stop_times', 'trips', 'routes']
+
+# Valeurs lues comme manquantes (mêmes conventions que gk.read_feed :
+# valeurs par défaut de pandas.read_csv, 'NA', 'N/A', 'None'..., plus ' ')
+VALEURS_MANQUANTES = sorted(STR_NA_VALUES | {' '})
+
+# Types nullables pandas des colonnes lues par pyarrow
+TYPES_PANDAS = {
+    pa.int64(): pd.Int64Dtype(),
+    pa.float64(): pd.Float64Dtype(),
+    pa.string(): pd.StringDtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
 
 
 ########################################################################
@@ -13,18 +60,188 @@ GTFS_ZIP_PATH = "data/TAM_MMM_GTFS.zip"  # À modifier
 ########################################################################
 
 
-def charger_gtfs(zip_path=GTFS_ZIP_PATH):
+def charger_gtfs(zip_path=GTFS_ZIP_PATH, dossier_cache=None):
     """
-    Charge le fichier GTFS à l'aide de gtfs_kit.
+    Charge le fichier GTFS sous forme de feed gtfs_kit (lecture via pyarrow).
+    Si dossier_cache est renseigné, les tables sont conservées au format
+    Parquet dans dossier_cache/v<VERSION_CACHE>-<sha1 du zip>/ et relues
+    directement lors des chargements suivants du même fichier. Un cache
+    illisible ou incomplet est ignoré : le zip est alors relu.
+    Args:
+        zip_path (str): Chemin du fichier GTFS zip
+        dossier_cache (str | None): Dossier du cache Parquet
     Returns:
         feed: gtfs_kit Feed object
     """
     print(f"Chargement du fichier GTFS : {zip_path}")
-    feed = gk.read_feed(zip_path, dist_units='km')
-    print(f"✓ GTFS chargé avec succès")
+
+    dossier_feed = None
+    if dossier_cache is not None:
+        with open(zip_path, 'rb') as f:
+            empreinte = hashlib.sha1(f.read()).hexdigest()
+        dossier_feed = os.path.join(dossier_cache, f'v{VERSION_CACHE}-{empreinte}')
+
+    feed = None
+    if dossier_feed is not None and os.path.isdir(dossier_feed):
+        try:
+            # Date d'utilisation : les GTFS relus récemment restent en cache
+            os.utime(dossier_feed)
+            feed = lire_feed_parquet(dossier_feed)
+            print(f"✓ GTFS chargé depuis le cache : {dossier_feed}")
+        except (OSError, pa.ArrowException) as e:
+            # Cache corrompu ou supprimé pendant la lecture (ex: par
+            # limiter_cache dans une autre session) : il est réécrit
+            print(f"⚠ Cache Parquet ignoré ({e})")
+            shutil.rmtree(dossier_feed, ignore_errors=True)
+
+    if feed is None:
+        feed = lire_feed_zip(zip_path)
+        if dossier_feed is not None:
+            ecrire_feed_parquet(feed, dossier_feed)
+        print(f"✓ GTFS chargé avec succès")
+
     return feed
 
 
+def lire_feed_zip(zip_path):
+    """
+    Lit les tables d'un GTFS zip avec le lecteur CSV multithread de pyarrow,
+    directement depuis l'archive (sans extraction sur disque), et construit
+    le feed gtfs_kit avec les types de gk.read_feed.
+    Les colonnes texte sont typées dès la lecture pour conserver les zéros
+    en tête des identifiants (ex: '0012').
+    Args:
+        zip_path (str): Chemin du fichier GTFS zip
+    Returns:
+        feed: gtfs_kit Feed object
+    """
+    tables = {}
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            nom = os.path.splitext(os.path.basename(info.filename))[0]
+            # Ignorer les dossiers, fichiers vides et fichiers non GTFS
+            if (
+                info.is_dir()
+                or not info.file_size
+                or not info.filename.endswith('.txt')
+                or nom not in gk.constants.DTYPES
+            ):
+                continue
+
+            dtypes = gk.constants.DTYPES[nom]
+            with zf.open(info) as f:
+                # En-tête lu à part : noms nettoyés (BOM, espaces, guillemets)
+                entete = f.readline().decode('utf-8-sig')
+                colonnes = [c.strip().strip('"').strip() for c in entete.split(',')]
+                table = pacsv.read_csv(
+                    f,
+                    read_options=pacsv.ReadOptions(column_names=colonnes),
+                    convert_options=pacsv.ConvertOptions(
+                        column_types={
+                            c: pa.string()
+                            for c in colonnes
+                            if dtypes.get(c) == 'string'
+                        },
+                        null_values=VALEURS_MANQUANTES,
+                        strings_can_be_null=True,
+                    ),
+                )
+
+            df = table.to_pandas(types_mapper=TYPES_PANDAS.get)
+            if not df.empty:
+                tables[nom] = df.astype(
+                    {c: t for c, t in dtypes.items() if c in df.columns}
+                )
+
+    return gk.Feed(dist_units='km', **tables)
+
+
+def ecrire_feed_parquet(feed, dossier):
+    """
+    Écrit les tables d'un feed au format Parquet (une table par fichier),
+    ainsi que la liste des tables écrites (FICHIER_TABLES).
+    L'écriture se fait dans un dossier temporaire renommé à la fin, pour
+    ne jamais laisser un cache incomplet. Le cache est optionnel : en cas
+    d'échec, un avertissement est affiché et rien n'est conservé.
+    Seuls les NB_FEEDS_CACHE GTFS utilisés le plus récemment sont gardés.
+    Args:
+        feed: gtfs_kit Feed object
+        dossier (str): Dossier de destination
+    """
+    parent = os.path.dirname(dossier) or '.'
+    dossier_tmp = None
+    try:
+        os.makedirs(parent, exist_ok=True)
+        dossier_tmp = tempfile.mkdtemp(dir=parent)
+
+        noms = []
+        for nom in TABLES_GTFS:
+            table = getattr(feed, nom, None)
+            if table is not None:
+                table.to_parquet(
+                    os.path.join(dossier_tmp, f'{nom}.parquet'), engine='pyarrow'
+                )
+                noms.append(nom)
+
+        with open(os.path.join(dossier_tmp, FICHIER_TABLES), 'w') as f:
+            f.write('\n'.join(noms))
+    except (OSError, pa.ArrowException) as e:
+        if dossier_tmp is not None:
+            shutil.rmtree(dossier_tmp, ignore_errors=True)
+        print(f"⚠ Cache Parquet non écrit ({e})")
+        return
+
+    try:
+        os.rename(dossier_tmp, dossier)
+    except OSError:
+        # Cache déjà écrit entre-temps pour ce même fichier
+        shutil.rmtree(dossier_tmp, ignore_errors=True)
+
+    limiter_cache(parent, NB_FEEDS_CACHE)
+
+
+def limiter_cache(dossier_cache, nb_max):
+    """
+    Supprime les GTFS les moins récemment utilisés du cache Parquet pour
+    n'en conserver que nb_max.
+    Args:
+        dossier_cache (str): Dossier du cache Parquet
+        nb_max (int): Nombre de GTFS à conserver
+    """
+    dossiers = [
+        entree.path for entree in os.scandir(dossier_cache) if entree.is_dir()
+    ]
+    dossiers.sort(key=os.path.getmtime, reverse=True)
+    for dossier in dossiers[nb_max:]:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+def lire_feed_parquet(dossier):
+    """
+    Reconstruit un feed gtfs_kit à partir des tables Parquet d'un dossier.
+    Toutes les tables listées dans FICHIER_TABLES doivent être présentes,
+    ainsi que les TABLES_REQUISES : un feed partiel n'est jamais renvoyé.
+    Args:
+        dossier (str): Dossier écrit par ecrire_feed_parquet
+    Returns:
+        feed: gtfs_kit Feed object
+    Raises:
+        FileNotFoundError: Si une table attendue est absente du dossier
+    """
+    with open(os.path.join(dossier, FICHIER_TABLES)) as f:
+        noms = f.read().split()
+
+    manquantes = [nom for nom in TABLES_REQUISES if nom not in noms]
+    if manquantes:
+        raise FileNotFoundError(f"Tables absentes du cache : {manquantes}")
+
+    tables = {
+        nom: pd.read_parquet(os.path.join(dossier, f'{nom}.parquet'), engine='pyarrow')
+        for nom in noms
+    }
+    return gk.Feed(dist_units='km', **tables)
+
+
 def obtenir_service_ids_pour_date(feed, date_str):
     """
     Identifie les service_id actifs pour une date donnée
@@ -53,44 +270,124 @@ def obtenir_service_ids_pour_date(feed, date_str):
     
     # 1. Vérifier calendar.txt
     if hasattr(feed, 'calendar') and feed.calendar is not None:
-        calendar = feed.calendar.copy()
-        # Convertir les dates
-        calendar['start_date'] = pd.to_datetime(calendar['start_date'], format='%Y%m%d')
-        calendar['end_date'] = pd.to_datetime(calendar['end_date'], format='%Y%m%d')
+        calendar = feed.calendar
         
         # Filtrer les services actifs ce jour
+        # Dates GTFS au format AAAAMMJJ : l'ordre des chaînes est l'ordre
+        # chronologique, aucune conversion ni copie n'est nécessaire
         jour_col = jour_mapping[jour_semaine]
-        services_calendar = calendar[
-            (calendar['start_date'] <= date_obj) &
-            (calendar['end_date'] >= date_obj) &
-            (calendar[jour_col] == 1)
-        ]['service_id'].tolist()
+        services_calendar = calendar.loc[
+            (calendar['start_date'] <= date_str) &
+            (calendar['end_date'] >= date_str) &
+            (calendar[jour_col] == 1),
+            'service_id'
+        ].tolist()
         
         service_ids.update(services_calendar)
     
     # 2. Vérifier calendar_dates.txt (exceptions)
     if hasattr(feed, 'calendar_dates') and feed.calendar_dates is not None:
-        calendar_dates = feed.calendar_dates.copy()
-        calendar_dates['date'] = pd.to_datetime(calendar_dates['date'], format='%Y%m%d')
+        calendar_dates = feed.calendar_dates
+        exceptions = calendar_dates[calendar_dates['date'] == date_str]
         
-        exceptions = calendar_dates[calendar_dates['date'] == date_obj]
+        type_exception = exceptions['exception_type']
+        # Services ajoutés (type 1) puis retirés (type 2) en une opération d'ensembles
+        services_ajoutes = exceptions.loc[type_exception == 1, 'service_id']
+        services_retires = exceptions.loc[type_exception == 2, 'service_id']
         
-        for _, row in exceptions.iterrows():
-            if row['exception_type'] == 1:  # Service ajouté
-                service_ids.add(row['service_id'])
-            elif row['exception_type'] == 2:  # Service retiré
-                service_ids.discard(row['service_id'])
+        service_ids = (service_ids | set(services_ajoutes)) - set(services_retires)
     
     service_ids = list(service_ids)
     print(f"✓ Services actifs le {date_str} : {len(service_ids)} service(s)")
     return service_ids
 
 
+def temps_en_secondes(temps):
+    """
+    Convertit une série de temps GTFS (HH:MM:SS) en secondes, en vectoriel.
+    Gère les heures > 24 (ex: 25:30:00 pour 01:30 le lendemain)
+    Args:
+        temps (pd.Series): Temps au format 'HH:MM:SS'
+    Returns:
+        pd.Series: Secondes depuis minuit (NaN si le temps est manquant)
+    """
+    parts = temps.str.split(':', n=2, expand=True).reindex(columns=range(3))
+    parts = parts.astype('float64')
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def secondes_en_temps(secondes):
+    """
+    Convertit une série de secondes en temps au format HH:MM:SS, en vectoriel.
+    Les heures ne sont pas ramenées à 24 (ex: 91800 -> 25:30:00).
+    Args:
+        secondes (pd.Series): Nombre de secondes
+    Returns:
+        pd.Series: Temps au format 'HH:MM:SS' (NaN si la valeur est manquante)
+    """
+    valides = secondes.dropna().astype('int64')
+    heures = (valides // 3600).astype(str).str.zfill(2)
+    minutes = (valides % 3600 // 60).astype(str).str.zfill(2)
+    sec = (valides % 60).astype(str).str.zfill(2)
+    return (heures + ':' + minutes + ':' + sec).reindex(secondes.index)
+
+
 ########################################################################
 # UTILITAIRES D'EXPORT ET DE LECTURE
 ########################################################################
 
 
+def generer_csv(df):
+    """
+    Génère le contenu CSV UTF-8 avec BOM (lisible par Excel) d'un DataFrame
+    à l'aide du writer CSV multithreadé de pyarrow : en-têtes et champs
+    texte entre guillemets, réels entiers écrits sans décimale (60 et non
+    60.0). Se replie sur pandas si une colonne n'est pas convertible en
+    table Arrow. Utilisé pour les exports et les téléchargements Streamlit.
+    
+    Parameters:
+    -----------
+    df : DataFrame
+        DataFrame à convertir (géométries éventuelles converties en WKT)
+    
+    Returns:
+    --------
+    bytes
+    """
+    if isinstance(df, gpd.GeoDataFrame):
+        df = df.to_wkt(rounding_precision=-1)
+    
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return df.to_csv(index=False).encode('utf-8-sig')
+    
+    # Catégories écrites comme leurs valeurs
+    for i, champ in enumerate(table.schema):
+        if pa.types.is_dictionary(champ.type):
+            colonne = table.column(i).cast(champ.type.value_type)
+            table = table.set_column(i, champ.name, colonne)
+    
+    tampon = pa.BufferOutputStream()
+    pacsv.write_csv(table, tampon)
+    return codecs.BOM_UTF8 + tampon.getvalue().to_pybytes()
+
+
+def ecrire_csv(df, chemin_fichier):
+    """
+    Écrit un DataFrame en CSV (format décrit dans generer_csv).
+    
+    Parameters:
+    -----------
+    df : DataFrame
+        DataFrame à écrire
+    chemin_fichier : str
+        Chemin du fichier de sortie
+    """
+    with open(chemin_fichier, 'wb') as f:
+        f.write(generer_csv(df))
+
+
 def exporter_df_to_csv(df, chemin_fichier):
     """
     Exporte un DataFrame en CSV
@@ -102,7 +399,7 @@ def exporter_df_to_csv(df, chemin_fichier):
     chemin_fichier : str
         Chemin du fichier de sortie
     """
-    df.to_csv(chemin_fichier, index=False, encoding='utf-8-sig')
+    ecrire_csv(df, chemin_fichier)
     print(f"✓ CSV exporté : {chemin_fichier}")
     
 def exporter_gdf_to_csv(gdf, chemin_fichier):
@@ -117,7 +414,7 @@ def exporter_gdf_to_csv(gdf, chemin_fichier):
         Chemin du fichier de sortie
     """
     df = gdf.drop(columns=['geometry'], errors='ignore')
-    df.to_csv(chemin_fichier, index=False, encoding='utf-8-sig')
+    ecrire_csv(df, chemin_fichier)
     print(f"✓ CSV exporté : {chemin_fichier}")
 
 
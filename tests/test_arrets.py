@@ -0,0 +1,56 @@
+"""
+Tests des indicateurs par arrêt sur un petit feed construit en mémoire.
+Lancement depuis la racine du projet : python -m unittest
+"""
+
+import unittest
+
+import gtfs_kit as gk
+import pandas as pd
+
+from src.arrets import calculer_indicateurs_arrets
+
+
+def creer_feed():
+    """Feed minimal : une ligne, un trip passant par deux arrêts."""
+    return gk.Feed(
+        dist_units="km",
+        stops=pd.DataFrame(
+            {
+                "stop_id": ["A", "B"],
+                "stop_name": ["Arrêt A", "Arrêt B"],
+                "stop_lat": [43.60, 43.61],
+                "stop_lon": [3.87, 3.88],
+            }
+        ),
+        trips=pd.DataFrame(
+            {"trip_id": ["T1"], "route_id": ["L1"], "service_id": ["S1"]}
+        ),
+        stop_times=pd.DataFrame(
+            {
+                "trip_id": ["T1", "T1"],
+                "stop_id": ["A", "B"],
+                "stop_sequence": [1, 2],
+                "arrival_time": ["08:00:00", "08:05:00"],
+                "departure_time": ["08:00:00", "08:05:00"],
+            }
+        ),
+    )
+
+
+class TestCalculerIndicateursArrets(unittest.TestCase):
+    def test_liste_de_services_vide(self):
+        self.assertIsNone(calculer_indicateurs_arrets(creer_feed(), [], "20251124"))
+
+    def test_services_sans_trip(self):
+        indicateurs = calculer_indicateurs_arrets(creer_feed(), ["nope"], "20251124")
+        self.assertEqual(indicateurs.shape, (0, 11))
+
+    def test_services_actifs(self):
+        indicateurs = calculer_indicateurs_arrets(creer_feed(), ["S1"], "20251124")
+        self.assertEqual(indicateurs.shape, (2, 11))
+        self.assertEqual(indicateurs["nombre_passages"].tolist(), [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,34 @@ import streamlit.components.v1 as components
 
 from src.arrets import calculer_indicateurs_arrets
 from src.cartographie import create_carte_arrets
+from src.utils import generer_csv
+
+
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def calculer_indicateurs_arrets_en_cache(
+    gtfs_hash, date_str, _feed, _active_service_ids
+):
+    """
+    Indicateurs par arrêt, mis en cache par (fichier GTFS, date).
+    """
+    return calculer_indicateurs_arrets(_feed, _active_service_ids, date_str)
+
+
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def generer_carte_arrets_en_cache(gtfs_hash, date_str, _indicateurs):
+    """
+    HTML de la carte des arrêts, mis en cache par (fichier GTFS, date) :
+    les indicateurs, et donc la carte, ne dépendent que de ce couple.
+    """
+    return create_carte_arrets(_indicateurs)._repr_html_()
+
+
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def generer_csv_arrets_en_cache(gtfs_hash, date_str, _indicateurs):
+    """
+    Contenu CSV des indicateurs par arrêt, mis en cache par (fichier GTFS, date).
+    """
+    return generer_csv(_indicateurs)
 
 
 def arrets_page():
@@ -22,10 +50,11 @@ def arrets_page():
         if st.session_state.indicateurs_arrets is None:
             with st.spinner("Calcul des indicateurs d'arrêts..."):
                 try:
-                    indicateurs = calculer_indicateurs_arrets(
+                    indicateurs = calculer_indicateurs_arrets_en_cache(
+                        st.session_state.gtfs_hash,
+                        st.session_state.date_str,
                         st.session_state.feed,
                         st.session_state.active_service_ids,
-                        st.session_state.date_str,
                     )
                     st.session_state.indicateurs_arrets = indicateurs
                 except Exception as e:
@@ -62,12 +91,16 @@ def arrets_page():
 
             # Carte
             st.header("🗺️ Carte des Arrêts")
-            m = create_carte_arrets(indicateurs)
-            components.html(m._repr_html_(), height=500, width=1000)
+            carte_html = generer_carte_arrets_en_cache(
+                st.session_state.gtfs_hash, st.session_state.date_str, indicateurs
+            )
+            components.html(carte_html, height=500, width=1000)
 
             # Télécharger les résultats
             st.header("💾 Téléchargement")
-            csv = indicateurs.to_csv(index=False).encode("utf-8")
+            csv = generer_csv_arrets_en_cache(
+                st.session_state.gtfs_hash, st.session_state.date_str, indicateurs
+            )
             st.download_button(
                 label="📥 Télécharger les résultats CSV",
                 data=csv,
@@ -6,9 +6,32 @@ import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
-from src.indicateurs_troncons import compute_indicateurs_troncons
+from src.indicateurs_troncons import ajouter_cle_paire, compute_indicateurs_troncons
 from src.cartographie import creer_carte_troncons
 from src.create_troncons_uniques import creer_troncons_uniques
+from src.utils import generer_csv
+
+
+@st.cache_data(show_spinner=False, max_entries=6, ttl=3600)
+def creer_troncons_uniques_en_cache(gtfs_hash, route_type, _feed):
+    """
+    Tronçons uniques d'un mode (avec leur clé de paire de stops), mis en
+    cache par (fichier GTFS, route_type) : ils ne dépendent pas de la date
+    analysée.
+    """
+    return ajouter_cle_paire(creer_troncons_uniques(_feed, route_type))
+
+
+@st.cache_data(show_spinner=False, max_entries=10, ttl=3600)
+def compute_indicateurs_troncons_en_cache(
+    gtfs_hash, date_str, _feed, _active_service_ids, _troncons_bus, _troncons_tram
+):
+    """
+    Indicateurs par tronçon (bus, tram), mis en cache par (fichier GTFS, date).
+    """
+    return compute_indicateurs_troncons(
+        _feed, _active_service_ids, _troncons_bus, _troncons_tram
+    )
 
 
 def charger_ou_calculer_troncons(feed, route_type, nom_mode):
@@ -35,7 +58,9 @@ def charger_ou_calculer_troncons(feed, route_type, nom_mode):
 
     try:
         # Calculer les tronçons uniques
-        troncons_gdf = creer_troncons_uniques(feed, route_type)
+        troncons_gdf = creer_troncons_uniques_en_cache(
+            st.session_state.gtfs_hash, route_type, feed
+        )
 
         st.success(f"✅ {len(troncons_gdf)} tronçons {nom_mode} calculés automatiquement")
         return troncons_gdf
@@ -45,6 +70,16 @@ def charger_ou_calculer_troncons(feed, route_type, nom_mode):
         return None
 
 
+def troncons_actifs(indicateurs):
+    """
+    Tronçons ayant au moins un passage (table vide si le mode n'a aucun
+    passage ce jour).
+    """
+    if indicateurs is None:
+        return pd.DataFrame(columns=["nombre_passages"])
+    return indicateurs[indicateurs["nombre_passages"] > 0]
+
+
 def troncons_page():
     st.markdown("---")
 
@@ -69,7 +104,7 @@ def troncons_page():
         # Calculer les indicateurs automatiquement si pas déjà fait
         if (
             st.session_state.indicateurs_bus is None
-            or st.session_state.indicateurs_tram is None
+            and st.session_state.indicateurs_tram is None
         ):
 
             with st.spinner("Chargement/Calcul des tronçons de référence..."):
@@ -90,7 +125,9 @@ def troncons_page():
             with st.spinner("Calcul des indicateurs de tronçons..."):
                 try:
 
-                    indicateurs_bus, indicateurs_tram = compute_indicateurs_troncons(
+                    indicateurs_bus, indicateurs_tram = compute_indicateurs_troncons_en_cache(
+                        st.session_state.gtfs_hash,
+                        st.session_state.date_str,
                         st.session_state.feed,
                         st.session_state.active_service_ids,
                         troncons_bus,
@@ -102,13 +139,29 @@ def troncons_page():
                     st.error(f"Erreur lors du calcul des tronçons : {e}")
                     return
 
-        if (
-            st.session_state.indicateurs_bus is not None
-            and st.session_state.indicateurs_tram is not None
-        ):
-
-            indicateurs_bus = st.session_state.indicateurs_bus
-            indicateurs_tram = st.session_state.indicateurs_tram
+        indicateurs_bus = st.session_state.indicateurs_bus
+        indicateurs_tram = st.session_state.indicateurs_tram
+
+        # Mode sans aucun passage ce jour : pas d'indicateurs pour ce mode,
+        # l'autre mode reste affiché
+        modes_sans_passage = [
+            nom_mode
+            for nom_mode, indicateurs in [
+                ("bus", indicateurs_bus),
+                ("tram", indicateurs_tram),
+            ]
+            if indicateurs is None
+        ]
+        if modes_sans_passage:
+            st.warning(
+                f"⚠️ Aucun passage {' ni '.join(modes_sans_passage)} ce jour : "
+                "indicateurs de tronçons indisponibles pour cette date."
+            )
+
+        if indicateurs_bus is not None or indicateurs_tram is not None:
+
+            bus_actifs = troncons_actifs(indicateurs_bus)
+            tram_actifs = troncons_actifs(indicateurs_tram)
 
             st.success("✅ Analyse des tronçons terminée !")
 
@@ -116,20 +169,14 @@ def troncons_page():
             st.header("📊 Statistiques Globales")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric(
-                    "Tronçons Bus actifs",
-                    len(indicateurs_bus[indicateurs_bus["nombre_passages"] > 0]),
-                )
+                st.metric("Tronçons Bus actifs", len(bus_actifs))
             with col2:
-                st.metric(
-                    "Tronçons Tram actifs",
-                    len(indicateurs_tram[indicateurs_tram["nombre_passages"] > 0]),
-                )
+                st.metric("Tronçons Tram actifs", len(tram_actifs))
             with col3:
-                total_bus = int(indicateurs_bus["nombre_passages"].sum())
+                total_bus = int(bus_actifs["nombre_passages"].sum())
                 st.metric("Total passages Bus", total_bus)
             with col4:
-                total_tram = int(indicateurs_tram["nombre_passages"].sum())
+                total_tram = int(tram_actifs["nombre_passages"].sum())
                 st.metric("Total passages Tram", total_tram)
 
             # Top tronçons
@@ -137,9 +184,6 @@ def troncons_page():
 
             with col1:
                 st.header("🚌 Top 10 Tronçons Bus")
-                bus_actifs = indicateurs_bus[
-                    indicateurs_bus["nombre_passages"] > 0
-                ].copy()
                 if not bus_actifs.empty:
                     bus_actifs = bus_actifs.sort_values(
                         "nombre_passages", ascending=False
@@ -156,9 +200,6 @@ def troncons_page():
 
             with col2:
                 st.header("🚊 Top 10 Tronçons Tram")
-                tram_actifs = indicateurs_tram[
-                    indicateurs_tram["nombre_passages"] > 0
-                ].copy()
                 if not tram_actifs.empty:
                     tram_actifs = tram_actifs.sort_values(
                         "nombre_passages", ascending=False
@@ -182,23 +223,27 @@ def troncons_page():
             st.header("💾 Téléchargement")
             col1, col2 = st.columns(2)
             with col1:
-                csv_bus = indicateurs_bus.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    label="📥 Télécharger Bus CSV",
-                    data=csv_bus,
-                    file_name=f"indicateurs_troncons_bus_{st.session_state.date_str}.csv",
-                    mime="text/csv",
-                )
+                if indicateurs_bus is not None:
+                    csv_bus = generer_csv(indicateurs_bus)
+                    st.download_button(
+                        label="📥 Télécharger Bus CSV",
+                        data=csv_bus,
+                        file_name=f"indicateurs_troncons_bus_{st.session_state.date_str}.csv",
+                        mime="text/csv",
+                    )
+                else:
+                    st.info("Aucun passage bus ce jour.")
             with col2:
-                csv_tram = indicateurs_tram.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    label="📥 Télécharger Tram CSV",
-                    data=csv_tram,
-                    file_name=f"indicateurs_troncons_tram_{st.session_state.date_str}.csv",
-                    mime="text/csv",
-                )
-        else:
-            st.info("🔄 Calcul des indicateurs en cours...")
+                if indicateurs_tram is not None:
+                    csv_tram = generer_csv(indicateurs_tram)
+                    st.download_button(
+                        label="📥 Télécharger Tram CSV",
+                        data=csv_tram,
+                        file_name=f"indicateurs_troncons_tram_{st.session_state.date_str}.csv",
+                        mime="text/csv",
+                    )
+                else:
+                    st.info("Aucun passage tram ce jour.")
     else:
         st.info(
             "👆 Veuillez charger un fichier GTFS et sélectionner une date dans la barre latérale."